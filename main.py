@@ -7,34 +7,144 @@ Sends random sensor data to MQTT broker for Node-RED processing
 import json
 import time
 import random
+import threading
+import queue
 import paho.mqtt.client as mqtt
-from datetime import datetime
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
 import logging
 from web3 import Web3
+import requests
+from requests.adapters import HTTPAdapter
 import os
+import mmap
+import socket
+import struct
+import signal
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+
+def json_dumps(obj):
+    """Serialize obj to compact UTF-8 JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+json_loads = orjson.loads if orjson is not None else json.loads
+
+# 'struct' wire format: uint32 Unix seconds, float32 temperature, float32 humidity
+SENSOR_STRUCT = struct.Struct('<Iff')
+WIRE_FORMATS = ('json', 'cbor', 'struct')
+
+# Shared generator with its methods bound once, avoiding per-call module lookups
+_rng = random.Random()
+_uniform = _rng.uniform
+_gauss = _rng.gauss
+
 class SensorSimulator:
-    def __init__(self, broker_host="localhost", broker_port=1883, topic="sensors/data", ganache_url=None, sender_wallet=None, receiver_wallet=None, offline_file='./mihai-lazar/offline-data.json'):
+    # Static sensor metadata, published once (retained) on the config topic
+    # instead of being repeated in every data payload
+    SENSOR_CONFIG = {
+        "location": "Office Room",
+        "unit_temp": "°C",
+        "unit_humidity": "%"
+    }
+    # Long field names used by offline records written before the short keys
+    _LEGACY_KEYS = {"sensor_id": "id", "timestamp": "ts", "temperature": "t", "humidity": "h"}
+
+    # Offline records are buffered in memory and flushed/fsynced every N appends
+    _offline_flush_every = 32
+    _offline_buffer_size = 1 << 16
+    # The offline file is rotated past this size; rotated files are dropped after the retention period
+    _offline_rotate_bytes = 10 << 20
+    _offline_retention = 7 * 24 * 3600
+    # Backoff (seconds) before retrying Ganache after a failed transaction
+    _bc_backoff_min = 5
+    _bc_backoff_max = 300
+    _bc_timeout = 5
+    # Readings waiting for the publish worker; overflow goes to offline storage
+    _outq_maxsize = 256
+    # paho flow control: QoS>0 messages awaiting acks, and messages queued client-side
+    _mqtt_max_inflight = 100
+    _mqtt_max_queued = 1000
+    # How long blocking (resync) publishes wait for paho to hand the message to the broker
+    _publish_timeout = 1.0
+    # How often the idle publish worker checks for a resync requested by on_connect
+    _worker_poll = 1.0
+
+    def __init__(self, broker_host="localhost", broker_port=1883, topic="sensors/data", ganache_url=None, sender_wallet=None, receiver_wallet=None, offline_file='./mihai-lazar/offline-data.ndjson', qos=0, tx_batch_size=16, config_topic=None, mqtt_protocol=mqtt.MQTTv5, wire_format='json', blockchain_relay=True):
         self.broker_host = broker_host
         self.broker_port = broker_port
         self.topic = topic
-        self.client = mqtt.Client()
+        self.qos = qos
+        self.config_topic = config_topic or f"{topic}/config"
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"Unknown wire format {wire_format!r}, expected one of {WIRE_FORMATS}")
+        if wire_format == 'cbor' and cbor2 is None:
+            raise ValueError("The 'cbor' wire format requires the cbor2 package")
+        if wire_format != 'json' and blockchain_relay:
+            raise ValueError(f"The {wire_format!r} wire format cannot be relayed to the blockchain by Node-RED, use blockchain_relay=False")
+        self.wire_format = wire_format
+        self.client = mqtt.Client(protocol=mqtt_protocol)
+        # MQTTv5 topic alias for self.topic, negotiated per connection in on_connect
+        # and dropped in on_disconnect; the lock keeps send_data from seeing a stale alias
+        self._topic_alias_props = None
+        self._topic_alias_sent = False
+        self._topic_alias_lock = threading.Lock()
         self.setup_mqtt()
         self.offline_mode = False  
+        self._np_rng = np.random.default_rng() if np is not None else None
+        self._outq = queue.Queue(maxsize=self._outq_maxsize)
+        self._worker = None
+        # Set on every (re)connection; the publish worker then resends offline data
+        self._resync_pending = False
 
         self.ganache_url = ganache_url
         self.sender_wallet = sender_wallet
         self.receiver_wallet = receiver_wallet
+        # Fields shared by every data transaction; only "data" changes per send
+        self._tx_template = {"from": sender_wallet, "to": receiver_wallet, "value": 0}
+        # With blockchain_relay, Node-RED forwards published readings to Ganache,
+        # so the simulator keeps no web3 client and only publishes to MQTT
+        self.blockchain_relay = blockchain_relay
         self.w3 = None
-        if self.ganache_url:
-            self.w3 = Web3(Web3.HTTPProvider(self.ganache_url))
+        self._tx_batch = []
+        self._tx_batch_size = max(1, tx_batch_size)
+        self._bc_healthy = True
+        self._bc_retry_at = 0.0
+        self._bc_backoff = self._bc_backoff_min
+        if self.ganache_url and blockchain_relay:
+            logger.info("Blockchain writes are relayed by Node-RED")
+        elif self.ganache_url:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.w3 = Web3(Web3.HTTPProvider(self.ganache_url, session=session, request_kwargs={'timeout': self._bc_timeout}))
             if not self.w3.is_connected():
                 logger.error("Failed to connect to Ganache")
                 self.offline_mode = True  
+                self._mark_blockchain_down()
             else:
                 logger.info("Connected to Ganache")
         
@@ -43,57 +153,128 @@ class SensorSimulator:
         offline_dir = os.path.dirname(self.offline_file)
         if not os.path.exists(offline_dir):
             os.makedirs(offline_dir, exist_ok=True)
-            logger.info(f"Created offline data directory: {offline_dir}")
-        logger.info(f"Offline data will be stored in: {self.offline_file}")
+            logger.info("Created offline data directory: %s", offline_dir)
+        logger.info("Offline data will be stored in: %s", self.offline_file)
+        self._offline_fp = None
+        self._unflushed = 0
+        # Ticks and the publish worker thread may both write offline records
+        self._offline_lock = threading.RLock()
+        self._open_offline_file()
+        self._import_legacy_offline_file()
+        self._prune_rotated_offline_files()
+
+    def __del__(self):
+        self._close_offline_file()
 
     def setup_mqtt(self):
-        """Setup MQTT client callbacks"""
+        """Setup MQTT client callbacks and flow control"""
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_publish = self.on_publish
+        self.client.max_inflight_messages_set(self._mqtt_max_inflight)
+        self.client.max_queued_messages_set(self._mqtt_max_queued)
         
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
-            logger.info(f"Connected to MQTT broker at {self.broker_host}:{self.broker_port}")
+            logger.info("Connected to MQTT broker at %s:%s", self.broker_host, self.broker_port)
+            self.offline_mode = False
+            self._resync_pending = True
+            self._set_tcp_nodelay()
+            self._setup_topic_alias(properties)
+            self.publish_config()
         else:
-            logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
+            logger.error("Failed to connect to MQTT broker. Return code: %s", rc)
             
-    def on_disconnect(self, client, userdata, rc):
+    def _setup_topic_alias(self, connack_properties):
+        """Use topic alias 1 for the data topic if the broker allows aliases.
+
+        Only QoS 0 publishes use it: paho resends unacknowledged QoS>0 messages
+        on the next connection, where an empty-topic alias is not mapped yet.
+        """
+        props = None
+        if self.qos == 0 and connack_properties is not None and getattr(connack_properties, "TopicAliasMaximum", 0) >= 1:
+            props = Properties(PacketTypes.PUBLISH)
+            props.TopicAlias = 1
+        with self._topic_alias_lock:
+            self._topic_alias_props = props
+            self._topic_alias_sent = False
+
+    def _clear_topic_alias(self):
+        """Forget the alias so no empty-topic publish reaches the next connection before CONNACK"""
+        with self._topic_alias_lock:
+            self._topic_alias_props = None
+            self._topic_alias_sent = False
+
+    def _set_tcp_nodelay(self):
+        """Disable Nagle's algorithm so small sensor payloads are not held back"""
+        sock = self.client.socket()
+        if sock is None:
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            logger.debug("Could not set TCP_NODELAY on MQTT socket: %s", e)
+
+    def publish_config(self):
+        """Publish the static sensor metadata as a retained message on the config topic.
+
+        It also carries the blockchain relay settings, so the Node-RED flow only
+        relays readings when blockchain_relay is set, using the same wallets.
+        """
+        config = {
+            **self.SENSOR_CONFIG,
+            "blockchain_relay": self.blockchain_relay,
+            "sender_wallet": self.sender_wallet,
+            "receiver_wallet": self.receiver_wallet
+        }
+        result = self.client.publish(self.config_topic, json_dumps(config), qos=1, retain=True)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.error("Failed to publish sensor config. Return code: %s", result.rc)
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        self._clear_topic_alias()
         logger.info("Disconnected from MQTT broker")
         
     def on_publish(self, client, userdata, mid):
-        logger.debug(f"Message {mid} published successfully")
+        logger.debug("Message %s published successfully", mid)
         
     def generate_temperature(self):
         """Generate realistic temperature data (Celsius)"""
         
         base_temp = 22.5
-        variation = random.uniform(-5, 8)
-        return round(base_temp + variation, 2)
+        variation = _uniform(-5, 8)
+        # Values are always positive, so this rounds to 2 decimals like round()
+        return int((base_temp + variation) * 100 + 0.5) / 100
         
     def generate_humidity(self):
         """Generate realistic humidity data (percentage)"""
         
-        humidity = random.normalvariate(50, 15)
-        return round(max(20, min(90, humidity)), 2)
+        humidity = _gauss(50, 15)
+        return int(max(20, min(90, humidity)) * 100 + 0.5) / 100
         
     def create_sensor_data(self, sensor_id="sensor_01"):
-        """Create sensor data payload"""
-        timestamp = datetime.now().isoformat()
-        temperature = self.generate_temperature()
-        humidity = self.generate_humidity()
-        
-        data = {
-            "sensor_id": sensor_id,
-            "timestamp": timestamp,
-            "temperature": temperature,
-            "humidity": humidity,
-            "location": "Office Room",
-            "unit_temp": "°C",
-            "unit_humidity": "%"
+        """Create sensor data payload (timestamp in Unix seconds)"""
+        return {
+            "id": sensor_id,
+            "ts": time.time(),
+            "t": self.generate_temperature(),
+            "h": self.generate_humidity()
         }
-        
-        return data
+
+    def create_sensor_batch(self, n, sensor_id="sensor_01", spacing=0.0):
+        """Create n sensor data payloads at once, spaced `spacing` seconds apart and ending now"""
+        if self._np_rng is not None:
+            temps = np.round(22.5 + self._np_rng.uniform(-5, 8, n), 2).tolist()
+            hums = np.round(np.clip(self._np_rng.normal(50, 15, n), 20, 90), 2).tolist()
+        else:
+            temps = [self.generate_temperature() for _ in range(n)]
+            hums = [self.generate_humidity() for _ in range(n)]
+
+        start = time.time() - (n - 1) * spacing
+        return [
+            {"id": sensor_id, "ts": start + i * spacing, "t": temperature, "h": humidity}
+            for i, (temperature, humidity) in enumerate(zip(temps, hums))
+        ]
         
     def connect(self):
         """Connect to MQTT broker"""
@@ -102,137 +283,413 @@ class SensorSimulator:
             self.client.loop_start()
             return True
         except Exception as e:
-            logger.error(f"Error connecting to MQTT broker: {e}")
+            logger.error("Error connecting to MQTT broker: %s", e)
             return False
             
     def disconnect(self):
         """Disconnect from MQTT broker"""
         self.client.loop_stop()
         self.client.disconnect()
+        self.flush_blockchain_batch()
+        self._close_offline_file()
         
-    def send_data(self, data, allow_offline_save=True):
-        """Send data to MQTT topic"""
+    def encode_payload(self, data, json_payload=None):
+        """Encode data in the configured MQTT wire format, reusing json_payload if given"""
+        if self.wire_format == 'struct':
+            return SENSOR_STRUCT.pack(int(data["ts"]), data["t"], data["h"])
+        if self.wire_format == 'cbor':
+            return cbor2.dumps(data)
+        return json_payload if json_payload is not None else json_dumps(data)
+
+    def send_data(self, data, payload=None, allow_offline_save=True, blocking=False):
+        """Send data to MQTT topic, reusing the wire-format payload if given.
+
+        Live ticks are fire-and-forget; with blocking=True the call waits until
+        paho reports the message as published, so it is not left in the
+        client's in-memory queue and lost on disconnect.
+        """
         try:
-            payload = json.dumps(data)
-            result = self.client.publish(self.topic, payload, qos=1)
+            if payload is None:
+                payload = self.encode_payload(data)
+            with self._topic_alias_lock:
+                props = self._topic_alias_props
+                if props is None:
+                    result = self.client.publish(self.topic, payload, qos=self.qos)
+                else:
+                    # The first publish binds the alias; later ones send an empty topic
+                    topic = "" if self._topic_alias_sent else self.topic
+                    result = self.client.publish(topic, payload, qos=self.qos, properties=props)
+                    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                        self._topic_alias_sent = True
             
+            if result.rc == mqtt.MQTT_ERR_SUCCESS and blocking:
+                result.wait_for_publish(self._publish_timeout)
+                if not result.is_published():
+                    logger.error("Timed out waiting for message %s to be published", result.mid)
+                    if allow_offline_save:
+                        self.save_data_offline(data)
+                    return False
+
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logger.info(f"Data sent: T={data['temperature']}°C, H={data['humidity']}%")
+                logger.info("Data sent: T=%s°C, H=%s%%", data.get('t'), data.get('h'))
                 return True
             else:
-                logger.error(f"Failed to send data. Return code: {result.rc}")
+                logger.error("Failed to send data. Return code: %s", result.rc)
                 if allow_offline_save:
                     self.save_data_offline(data)
                 return False
                 
         except Exception as e:
-            logger.error(f"Error sending data: {e}")
+            logger.error("Error sending data: %s", e)
             if allow_offline_save:
                 self.save_data_offline(data)
             return False
             
-    def send_to_blockchain(self, data, allow_offline_save=True):
-        """Send data to Ganache blockchain"""
-        if not self.w3 or not self.w3.is_connected():
+    def send_to_blockchain(self, data, payload=None, allow_offline_save=True):
+        """Queue data for the Ganache blockchain, sending a transaction once a batch is full"""
+        if not self.w3:
             logger.error("Not connected to Ganache. Cannot send data.")
             if allow_offline_save:
                 self.save_data_offline(data)
             return False
 
+        if payload is None:
+            payload = json_dumps(data)
+        self._tx_batch.append((data, payload))
+        if len(self._tx_batch) < self._tx_batch_size:
+            return True
+        return self.flush_blockchain_batch(allow_offline_save)
+
+    def flush_blockchain_batch(self, allow_offline_save=True):
+        """Send any queued data points to the blockchain as one transaction"""
+        if not self._tx_batch:
+            return True
+        batch, self._tx_batch = self._tx_batch, []
+        return self._send_batch_transaction(batch, allow_offline_save)
+
+    def _send_batch_transaction(self, batch, allow_offline_save=True):
+        """Send (data, payload) pairs to Ganache as a single JSON array transaction"""
+        if not self.w3:
+            logger.error("Not connected to Ganache. Cannot send data.")
+            if allow_offline_save:
+                for data, _ in batch:
+                    self.save_data_offline(data)
+            return False
+
+        if not self._bc_healthy and time.monotonic() < self._bc_retry_at:
+            logger.warning("Ganache unavailable, skipping blockchain transaction until the next retry.")
+            if allow_offline_save:
+                for data, _ in batch:
+                    self.save_data_offline(data)
+            return False
+
         try:
-            tx_hash = self.w3.eth.send_transaction({
-                "from": self.sender_wallet,
-                "to": self.receiver_wallet,
-                "value": self.w3.to_wei(0, "ether"), 
-                "data": json.dumps(data).encode('utf-8').hex()
-            })
-            logger.info(f"Data sent to blockchain. Transaction hash: {tx_hash.hex()}")
+            tx_data = b'[' + b','.join(payload for _, payload in batch) + b']'
+            tx_hash = self.w3.eth.send_transaction({**self._tx_template, "data": tx_data.hex()})
+            logger.info("Batch of %s data points sent to blockchain. Transaction hash: %s", len(batch), tx_hash.hex())
+            self._mark_blockchain_up()
             return True
         except Exception as e:
-            logger.error(f"Error sending data to blockchain: {e}")
+            logger.error("Error sending data to blockchain: %s", e)
+            self._mark_blockchain_down()
             if allow_offline_save:
-                self.save_data_offline(data)
+                for data, _ in batch:
+                    self.save_data_offline(data)
             return False
 
+    def _mark_blockchain_up(self):
+        """Reset the Ganache backoff after a successful transaction"""
+        if not self._bc_healthy:
+            logger.info("Ganache is reachable again")
+        self._bc_healthy = True
+        self._bc_backoff = self._bc_backoff_min
+
+    def _mark_blockchain_down(self):
+        """Skip Ganache until the backoff expires, doubling it on each failure"""
+        self._bc_healthy = False
+        self._bc_retry_at = time.monotonic() + self._bc_backoff
+        logger.warning("Retrying Ganache in %s seconds", self._bc_backoff)
+        self._bc_backoff = min(self._bc_backoff * 2, self._bc_backoff_max)
+
+    def _open_offline_file(self):
+        """Open the long-lived append handle for the offline file"""
+        self._offline_fp = open(self.offline_file, 'ab', buffering=self._offline_buffer_size)
+        self._offline_bytes = os.fstat(self._offline_fp.fileno()).st_size
+        self._unflushed = 0
+
+    def _flush_offline_file(self):
+        """Flush buffered offline records and fsync them to disk"""
+        if self._offline_fp is None or not self._unflushed:
+            return
+        self._offline_fp.flush()
+        os.fsync(self._offline_fp.fileno())
+        self._unflushed = 0
+
+    def _close_offline_file(self):
+        """Flush and close the offline file handle, if open"""
+        fp = getattr(self, '_offline_fp', None)
+        if fp is None:
+            return
+        with self._offline_lock:
+            try:
+                self._flush_offline_file()
+            finally:
+                fp.close()
+                self._offline_fp = None
+
+    def _import_legacy_offline_file(self):
+        """Move records from a JSON array offline file written by older versions into the NDJSON log"""
+        root, ext = os.path.splitext(self.offline_file)
+        legacy_file = root + '.json'
+        if ext == '.json' or not os.path.exists(legacy_file):
+            return
+        try:
+            with open(legacy_file, 'rb') as f:
+                content = f.read().strip()
+            records = json_loads(content) if content else []
+            if not isinstance(records, list):
+                raise ValueError("expected a JSON array")
+        except (ValueError, OSError) as e:
+            logger.error("Could not import legacy offline data from %s, leaving it in place: %s", legacy_file, e)
+            return
+        try:
+            lines = b''.join(json_dumps(record) + b'\n' for record in records)
+            with self._offline_lock:
+                self._offline_fp.write(lines)
+                self._offline_bytes += len(lines)
+                self._unflushed += len(records)
+                self._flush_offline_file()
+            os.remove(legacy_file)
+        except (TypeError, OSError) as e:
+            logger.error("Error importing legacy offline data from %s: %s", legacy_file, e)
+            return
+        logger.warning("Imported %s data points from legacy offline file %s", len(records), legacy_file)
+
+    def _rotated_offline_files(self):
+        """Return rotated offline files (<name>.<unix time><ext>), oldest first"""
+        root, ext = os.path.splitext(self.offline_file)
+        directory = os.path.dirname(self.offline_file)
+        prefix = os.path.basename(root) + '.'
+        rotated = []
+        for name in os.listdir(directory):
+            if not (name.startswith(prefix) and name.endswith(ext)):
+                continue
+            stamp = name[len(prefix):len(name) - len(ext)]
+            if stamp.isdigit():
+                rotated.append((int(stamp), os.path.join(directory, name)))
+        return [path for _, path in sorted(rotated)]
+
+    def _rotate_offline_file(self):
+        """Move the full offline file aside and start a new one"""
+        with self._offline_lock:
+            self._close_offline_file()
+            root, ext = os.path.splitext(self.offline_file)
+            # Stamps must keep increasing so rotated files replay in write order
+            stamp = int(time.time())
+            existing = self._rotated_offline_files()
+            if existing:
+                newest = existing[-1]
+                stamp = max(stamp, int(newest[len(root) + 1:len(newest) - len(ext)]) + 1)
+            rotated = f"{root}.{stamp}{ext}"
+            os.replace(self.offline_file, rotated)
+            logger.info("Rotated offline data file to %s", rotated)
+            self._open_offline_file()
+
+    def _prune_rotated_offline_files(self):
+        """Delete rotated offline files older than the retention period"""
+        cutoff = time.time() - self._offline_retention
+        for path in self._rotated_offline_files():
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    logger.warning("Dropped expired offline data file %s", path)
+            except OSError as e:
+                logger.error("Error removing expired offline data file %s: %s", path, e)
+
     def save_data_offline(self, data):
-        """Save data to a local file when offline."""
+        """Append data to the local NDJSON file when offline."""
         try:
-            
-            offline_file_path = os.path.abspath(self.offline_file)
-            logger.info(f"Attempting to save data offline to {offline_file_path}")
-            
-            
-            offline_data = []
-            
-            
-            if os.path.exists(offline_file_path):
-                logger.info(f"Reading existing offline data from {offline_file_path}")
-                try:
-                    with open(offline_file_path, 'r') as f:
-                        content = f.read().strip()
-                        if content:
-                            offline_data = json.loads(content)
-                            logger.info(f"Successfully read {len(offline_data)} records from offline file")
-                        else:
-                            logger.info("Offline file exists but is empty")
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Could not decode JSON from {offline_file_path}: {e}. Starting with a new list.")
-                except Exception as e:
-                    logger.warning(f"Error reading offline file: {e}. Starting with a new list.")
-            else:
-                logger.info(f"Offline file {offline_file_path} does not exist yet. Will create it.")
-            
-            
-            offline_data.append(data)
-            logger.info(f"Adding new data point. Total records: {len(offline_data)}")
-            
-            
-            with open(offline_file_path, 'w') as f:
-                json.dump(offline_data, f, indent=4)
-            logger.info(f"Data successfully saved offline to {offline_file_path}")
+            record = json_dumps(data) + b'\n'
+            with self._offline_lock:
+                if self._offline_fp is None:
+                    self._open_offline_file()
+                if self._offline_bytes and self._offline_bytes + len(record) > self._offline_rotate_bytes:
+                    self._rotate_offline_file()
+                self._offline_fp.write(record)
+                self._offline_bytes += len(record)
+                self._unflushed += 1
+                if self._unflushed >= self._offline_flush_every:
+                    self._flush_offline_file()
+            logger.debug("Data saved offline to %s", self.offline_file)
         except Exception as e:
-            logger.error(f"Error saving data offline: {e}")
-            logger.error(f"Current directory: {os.getcwd()}")
+            logger.error("Error saving data offline: %s", e)
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error("Current directory: %s", os.getcwd())
 
     def resync_offline_data(self):
-        """Resynchronize offline data."""
-        if not os.path.exists(self.offline_file):
-            return
+        """Resynchronize offline data, oldest rotated file first, stopping at the first record that fails.
 
+        The current file is rotated aside under the offline lock, so new
+        offline records go to a fresh file while the rotated ones are replayed
+        without holding it.
+        """
         try:
-            with open(self.offline_file, 'r') as f:
-                content = f.read()
-                if not content:
+            with self._offline_lock:
+                if self._offline_fp is None:
+                    self._open_offline_file()
+                if self._offline_bytes:
+                    self._rotate_offline_file()
+            for path in self._rotated_offline_files():
+                if not self._resync_file(path):
                     return
-                offline_data = json.loads(content)
-            
-            if not offline_data:
-                return
+                os.remove(path)
+        except Exception as e:
+            logger.error("Error resynchronizing offline data: %s", e)
 
-            logger.info(f"Resynchronizing {len(offline_data)} offline data points.")
-            
-            remaining_data = []
-            for data in offline_data:
-                mqtt_success = self.send_data(data, allow_offline_save=False)
-                blockchain_success = self.send_to_blockchain(data, allow_offline_save=False)
-                if not mqtt_success or not blockchain_success:
-                    remaining_data.append(data)
-
-            if not remaining_data:
-                logger.info("Offline data resynchronized successfully.")
-                os.remove(self.offline_file)
+    def _resync_file(self, path):
+        """Resend the records of one NDJSON file, keeping only its unsent tail.
+
+        Returns True if every record was delivered.
+        """
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return True
+
+        remaining_file = path + '.tmp'
+        try:
+            logger.info("Resynchronizing offline data from %s", path)
+
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                sent, failed_at = self._resync_records(mm)
+                if failed_at is not None and failed_at > 0:
+                    # Everything before failed_at was delivered; keep only the tail
+                    tail = mm[failed_at:]
+                    with open(remaining_file, 'wb') as out:
+                        out.write(tail)
+
+            if failed_at is None:
+                if sent:
+                    logger.info("Offline data resynchronized successfully (%s data points).", sent)
+                return True
+            if failed_at > 0:
+                os.replace(remaining_file, path)
+                remaining = tail.count(b'\n') + (not tail.endswith(b'\n'))
+                logger.warning("%s data points failed to resynchronize. Assuming offline.", remaining)
             else:
-                with open(self.offline_file, 'w') as f:
-                    json.dump(remaining_data, f, indent=4)
-                logger.warning(f"{len(remaining_data)} data points failed to resynchronize. Assuming offline.")
+                logger.warning("No offline data could be resynchronized. Assuming offline.")
+            return False
 
-        except (json.JSONDecodeError, FileNotFoundError) as e:
-            logger.error(f"Error reading or decoding offline data file: {e}")
+        except FileNotFoundError as e:
+            logger.error("Error reading offline data file: %s", e)
         except Exception as e:
-            logger.error(f"Error resynchronizing offline data: {e}")
+            logger.error("Error resynchronizing offline data: %s", e)
+        return False
+
+    def _resync_records(self, mm):
+        """Send NDJSON records from mm in order.
+
+        Returns the number of records sent and the byte offset of the first
+        record that could not be delivered (None if all were sent).
+        """
+        sent = 0
+        pending = []
+        failed_at = None
+        pos = 0
+        size = len(mm)
+        while pos < size:
+            start = pos
+            end = mm.find(b'\n', pos)
+            if end == -1:
+                end = size
+            line = mm[start:end].strip()
+            pos = end + 1
+            if not line:
+                continue
+            try:
+                data = json_loads(line)
+                if isinstance(data, dict) and "t" not in data:
+                    data = self._upgrade_legacy_record(data)
+                    line = json_dumps(data)
+            except (ValueError, TypeError) as e:
+                logger.warning("Skipping corrupt offline record: %s", e)
+                continue
+            if not self._is_sensor_record(data):
+                logger.warning("Skipping invalid offline record: %s", mm[start:end].strip()[:200])
+                continue
+
+            if not self.send_data(data, self.encode_payload(data, line), allow_offline_save=False, blocking=True):
+                failed_at = start
+                break
+            if self.w3 is None:
+                sent += 1
+                continue
+            pending.append((data, line, start))
+            if len(pending) >= self._tx_batch_size:
+                if not self._send_batch_transaction([(d, p) for d, p, _ in pending], allow_offline_save=False):
+                    return sent, pending[0][2]
+                sent += len(pending)
+                pending = []
+
+        if pending:
+            if not self._send_batch_transaction([(d, p) for d, p, _ in pending], allow_offline_save=False):
+                return sent, pending[0][2]
+            sent += len(pending)
+        return sent, failed_at
 
-    def run_simulation(self, interval=10, duration=None):
-        """Run the sensor simulation"""
+    def _is_sensor_record(self, data):
+        """Check that data is a short-key reading that can be published and encoded"""
+        if not isinstance(data, dict) or "id" not in data:
+            return False
+        return all(isinstance(data.get(key), (int, float)) for key in ("ts", "t", "h"))
+
+    def _upgrade_legacy_record(self, data):
+        """Convert an offline record with long field names to the short-key payload"""
+        data = {short: data[long] for long, short in self._LEGACY_KEYS.items() if long in data}
+        if isinstance(data.get("ts"), str):
+            data["ts"] = datetime.fromisoformat(data["ts"]).timestamp()
+        return data
+
+    def _start_publish_worker(self):
+        """Start the thread that publishes queued readings"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._publish_worker, name="publish-worker", daemon=True)
+        self._worker.start()
+
+    def _stop_publish_worker(self):
+        """Let the worker drain the queue, then wait for it to exit"""
+        if self._worker is None:
+            return
+        self._outq.put(None)
+        self._worker.join()
+        self._worker = None
+
+    def _publish_worker(self):
+        """Send queued (data, wire payload, JSON payload) readings to MQTT and the blockchain,
+        resynchronizing offline data after each (re)connection"""
+        while True:
+            if self._resync_pending:
+                self._resync_pending = False
+                self.resync_offline_data()
+            try:
+                item = self._outq.get(timeout=self._worker_poll)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            sensor_data, wire_payload, json_payload = item
+            try:
+                mqtt_success = self.send_data(sensor_data, wire_payload)
+                if self.w3:
+                    self.send_to_blockchain(sensor_data, json_payload)
+                # Without a web3 client (relay mode) only MQTT counts; on_connect
+                # clears offline_mode again after a reconnect
+                if not mqtt_success and self.w3 is not None and not self._bc_healthy:
+                    self.offline_mode = True
+            except Exception as e:
+                logger.error("Error in publish worker: %s", e)
+
+    def run_simulation(self, interval=10, duration=None, batch_size=1):
+        """Run the sensor simulation, generating batch_size readings per interval"""
         connected = self.connect()
         if not connected:
             logger.warning("Initial connection to MQTT broker failed. Starting in offline mode.")
@@ -241,16 +698,17 @@ class SensorSimulator:
         else:
             self.offline_mode = False
             
-        logger.info(f"Starting sensor simulation. Publishing to topic: {self.topic}")
-        logger.info(f"Data will be sent every {interval} seconds")
-        logger.info(f"Offline data will be saved to: {os.path.abspath(self.offline_file)}")
+        logger.info("Starting sensor simulation. Publishing to topic: %s", self.topic)
+        logger.info("Data will be sent every %s seconds", interval)
+        logger.info("Offline data will be saved to: %s", self.offline_file)
         
         start_time = time.time()
+        previous_sigterm = self._install_sigterm_handler()
         
         try:
-            if connected:
-                self.resync_offline_data()
-
+            # Offline data is resynchronized by the worker once the broker accepts the connection
+            self._start_publish_worker()
+            next_tick = time.monotonic()
             while True:
                 
                 if duration and (time.time() - start_time) >= duration:
@@ -258,51 +716,79 @@ class SensorSimulator:
                     break
                     
                 
-                sensor_data = self.create_sensor_data()
-                
-                
-                if self.offline_mode:
-                    logger.info("Running in offline mode, saving data directly to offline storage")
-                    self.save_data_offline(sensor_data)
+                if batch_size > 1:
+                    readings = self.create_sensor_batch(batch_size, spacing=interval / batch_size)
                 else:
-                    mqtt_success = self.send_data(sensor_data)
-                    blockchain_success = self.send_to_blockchain(sensor_data)
-                    
-                    
-                    if not mqtt_success and not blockchain_success:
-                        self.offline_mode = True
+                    readings = [self.create_sensor_data()]
                 
+                for sensor_data in readings:
+                    if self.offline_mode:
+                        logger.debug("Running in offline mode, saving data directly to offline storage")
+                        self.save_data_offline(sensor_data)
+                    else:
+                        try:
+                            json_payload = json_dumps(sensor_data)
+                            self._outq.put_nowait((sensor_data, self.encode_payload(sensor_data, json_payload), json_payload))
+                        except queue.Full:
+                            logger.warning("Publish queue is full, saving data to offline storage")
+                            self.save_data_offline(sensor_data)
                 
-                time.sleep(interval)
+                # Sleep until the next tick deadline so send time doesn't add drift
+                next_tick += interval
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_tick = time.monotonic()
                 
         except KeyboardInterrupt:
             logger.info("Simulation stopped by user")
+        except SystemExit:
+            logger.info("Simulation stopped by SIGTERM")
         except Exception as e:
-            logger.error(f"Error during simulation: {e}")
+            logger.error("Error during simulation: %s", e)
         finally:
+            self._stop_publish_worker()
             self.disconnect()
+            if previous_sigterm is not None:
+                signal.signal(signal.SIGTERM, previous_sigterm)
             logger.info("Sensor simulation ended")
 
+    def _install_sigterm_handler(self):
+        """Turn SIGTERM (e.g. docker stop) into SystemExit so run_simulation shuts down through its
+        finally block and flushes the pending blockchain batch; returns the previous handler"""
+        if threading.current_thread() is not threading.main_thread():
+            return None
+
+        def handle_sigterm(signum, frame):
+            raise SystemExit(0)
+
+        return signal.signal(signal.SIGTERM, handle_sigterm)
+
 def main():
     
     MQTT_BROKER = "mqtt.beia-telemetrie.ro"  
     MQTT_PORT = 1883
     MQTT_TOPIC = "training/device/mihai-lazar"
+    MQTT_QOS = 0
     SEND_INTERVAL = 10  
 
     
     GANACHE_URL = "HTTP://127.0.0.1:7545"
     SENDER_WALLET = "0xC0aC600eE9Cf816F26572889B76170Ce9b95A8C4"
     RECEIVER_WALLET = "0xA0Da51F9831C27123d26A1D91470C29f479EC552"
+    BLOCKCHAIN_RELAY = True  # Node-RED sends the readings to Ganache
     
     
     simulator = SensorSimulator(
         broker_host=MQTT_BROKER,
         broker_port=MQTT_PORT,
         topic=MQTT_TOPIC,
+        qos=MQTT_QOS,
         ganache_url=GANACHE_URL,
         sender_wallet=SENDER_WALLET,
-        receiver_wallet=RECEIVER_WALLET
+        receiver_wallet=RECEIVER_WALLET,
+        blockchain_relay=BLOCKCHAIN_RELAY
     )
     
         